@@ -2,21 +2,69 @@ import os
 import sys
 import glob
 import time
+import shutil
 import zipfile
-import pandas as pd
+import itertools
+import queue
+import threading
+import multiprocessing
+from collections import defaultdict
+import polars as pl
 import sqlite3
-import sqlalchemy
-import dask.dataframe as dd
+import duckdb
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor
+
+def _parquet_path(output_folder, file_path):
+    """Returns the path of the cached Parquet conversion of an extracted CSV file."""
+    return os.path.join(output_folder, 'parquet', os.path.basename(file_path) + '.parquet')
+
+def _extract_one(zip_file, output_folder):
+    """Extracts a single zip file into pre-allocated files, copying each member with a 1 MiB buffer."""
+    print(f'Unzipping {zip_file}')
+    extracted = []
+    with zipfile.ZipFile(zip_file, 'r') as zip_ref:
+        for member in zip_ref.infolist():
+            if member.is_dir():
+                continue
+            # Sanitize the member name as extractall does, so it cannot escape output_folder
+            arcname = os.path.splitdrive(member.filename.replace('\\', '/'))[1]
+            parts = [part for part in arcname.split('/') if part not in ('', '.', '..')]
+            if not parts:
+                continue
+            target = os.path.join(output_folder, *parts)
+            extracted.append(target)
+            # Already converted on a previous run: the loader reads the cached Parquet file instead
+            if os.path.exists(_parquet_path(output_folder, target)):
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with zip_ref.open(member) as src, open(target, 'wb') as dst:
+                if member.file_size > 0 and hasattr(os, 'posix_fallocate'):
+                    os.posix_fallocate(dst.fileno(), 0, member.file_size)
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+    return extracted
 
 class CNPJDatabaseBuilder:
-    def __init__(self, input_folder, output_folder, db_name='cnpj.db', delete_unzipped_files=True):
+    def __init__(self, input_folder, output_folder, db_name=None, delete_unzipped_files=True, backend='sqlite'):
+        if backend not in ('sqlite', 'duckdb'):
+            raise ValueError(f"Unknown backend '{backend}'. Use 'sqlite' or 'duckdb'.")
         self.input_folder = input_folder
         self.output_folder = output_folder
+        self.backend = backend
+        if db_name is None:
+            db_name = 'cnpj.duckdb' if backend == 'duckdb' else 'cnpj.db'
         self.db_path = os.path.join(self.output_folder, db_name)
         self.delete_unzipped_files = delete_unzipped_files
         self.engine = None
-        self.engine_url = None
+        self.duck = None
+        self.table_prefix = ''
         self.data_reference = None
+        self.insert_batch_size = 100_000
+        self.max_staged_archives = os.cpu_count()
+        self.zip_files = []
+        self._files_by_ext = defaultdict(list)
         
     def check_and_prepare_output(self):
         """Checks if the output database already exists and prepares the output directory."""
@@ -26,35 +74,109 @@ class CNPJDatabaseBuilder:
         if not os.path.exists(self.output_folder):
             os.makedirs(self.output_folder)
     
-    def unzip_files(self):
-        """Unzips all zip files in the input folder to the output folder."""
-        zip_files = glob.glob(os.path.join(self.input_folder, '*.zip'))
-        if len(zip_files) != 37:
-            response = input(f'The folder {self.input_folder} should contain 37 zip files, but found {len(zip_files)}. Do you want to proceed anyway? (y/n) ')
+    def check_zip_files(self):
+        """Lists the zip files in the input folder and checks that all of them are present."""
+        self.zip_files = glob.glob(os.path.join(self.input_folder, '*.zip'))
+        if len(self.zip_files) != 37:
+            response = input(f'The folder {self.input_folder} should contain 37 zip files, but found {len(self.zip_files)}. Do you want to proceed anyway? (y/n) ')
             if response.lower() != 'y':
                 print('Please ensure all required zip files are in the input folder.')
                 sys.exit()
-        print('Starting to unzip files:', time.asctime())
-        for zip_file in zip_files:
-            print(f'Unzipping {zip_file}')
-            with zipfile.ZipFile(zip_file, 'r') as zip_ref:
-                zip_ref.extractall(self.output_folder)
-        print('Finished unzipping files:', time.asctime())
+    
+    def unzip_and_load_files(self):
+        """Unzips the zip files in parallel while the extracted files are loaded into the database."""
+        print('Starting to unzip and load files:', time.asctime())
+        # Limits how many archives may sit extracted on disk before being loaded,
+        # which also bounds the queue, so the done-callbacks never block on it
+        staged = threading.BoundedSemaphore(self.max_staged_archives)
+        extracted = queue.Queue()
+        failed = threading.Event()
+        
+        def extract_all():
+            # Workers are started from this thread while the loader runs; forking a multithreaded process is unsafe
+            start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            with ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context(start_method)) as executor:
+                for zip_file in self.zip_files:
+                    staged.acquire()
+                    if failed.is_set():
+                        executor.shutdown(cancel_futures=True)
+                        break
+                    executor.submit(_extract_one, zip_file, self.output_folder).add_done_callback(extracted.put)
+            extracted.put(None)
+        
+        producer = threading.Thread(target=extract_all, daemon=True)
+        producer.start()
+        # The database connection belongs to this thread, so every load happens here
+        try:
+            while (future := extracted.get()) is not None:
+                for file_path in future.result():
+                    self.load_file(file_path)
+                staged.release()
+        except BaseException:
+            # Stop submitting archives; the slot of the failed one wakes the producer if it is waiting
+            failed.set()
+            staged.release()
+            producer.join()
+            raise
+        producer.join()
+        for extension in [*self.code_tables, *self.large_tables]:
+            if not self._files_by_ext[extension]:
+                print(f'File with extension {extension} not found.')
+        print('Finished unzipping and loading files:', time.asctime())
+    
+    @staticmethod
+    def _file_key(file_name):
+        """Returns the extension used to look up an extracted file, e.g. '.EMPRECSV'."""
+        # Simples files are named like 'F.K03200$W.SIMPLES.CSV.D30610'
+        if '.SIMPLES.CSV.' in file_name.upper():
+            return '.SIMPLES.CSV.*'
+        return os.path.splitext(file_name)[1].upper()
     
     def connect_to_database(self):
-        """Connects to the SQLite database."""
+        """Connects to the database and tunes it for bulk loading."""
+        if self.backend == 'duckdb':
+            # DuckDB loads the files straight into its own database
+            self.engine = duckdb.connect(self.db_path)
+            self.duck = self.engine
+            self.table_prefix = ''
+            return
         self.engine = sqlite3.connect(self.db_path)
-        self.engine_url = f'sqlite:///{self.db_path}'
+        # The database is built from scratch in a single run, so durability is
+        # traded for load speed on this connection (code tables, indexes and the
+        # socios table): no rollback journal and no fsync per commit.
+        # These PRAGMAs do not reach DuckDB's own SQLite connection, so the large
+        # tables are written with the default journal, one transaction per file.
+        # The lock is left in NORMAL mode so that DuckDB can write to the same file.
+        self.engine.executescript(
+            'PRAGMA journal_mode=OFF;'
+            'PRAGMA synchronous=OFF;'
+            'PRAGMA temp_store=MEMORY;'
+            'PRAGMA cache_size=-1048576;'
+            'PRAGMA mmap_size=30000000000;'
+        )
+        # DuckDB parses the large CSV files and writes them into the attached SQLite database
+        self.duck = duckdb.connect()
+        self.duck.execute('INSTALL sqlite; LOAD sqlite;')
+        db_path = self.db_path.replace("'", "''")
+        self.duck.execute(f"ATTACH '{db_path}' AS s (TYPE sqlite);")
+        self.table_prefix = 's.'
     
     def disconnect_database(self):
-        """Closes the connection to the SQLite database."""
+        """Closes the connections to the database."""
+        if self.backend == 'duckdb':
+            if self.engine:
+                self.engine.close()
+            return
+        if self.duck:
+            self.duck.execute('DETACH s;')
+            self.duck.close()
         if self.engine:
             self.engine.commit()
             self.engine.close()
     
     def get_data_reference(self):
         """Extracts the data reference date from one of the files."""
-        emp_files = glob.glob(os.path.join(self.output_folder, '*.EMPRECSV'))
+        emp_files = self._files_by_ext['.EMPRECSV']
         if emp_files:
             data_ref_str = os.path.basename(emp_files[0]).split('.')[2]
             if len(data_ref_str) == len('D30610') and data_ref_str.startswith('D'):
@@ -64,9 +186,43 @@ class CNPJDatabaseBuilder:
         else:
             self.data_reference = 'Unknown'
     
-    def load_code_tables(self):
-        """Loads smaller code tables into the database and creates indexes."""
-        code_files = {
+    def load_file(self, file_path):
+        """Loads an extracted file into the table matching its extension."""
+        key = self._file_key(os.path.basename(file_path))
+        self._files_by_ext[key].append(file_path)
+        if key in self.code_tables:
+            self.load_code_table(self.code_tables[key], file_path)
+        elif key in self.large_tables:
+            self.load_large_file(*self.large_tables[key], file_path)
+        else:
+            print(f'Skipping file with unknown extension {file_path}')
+    
+    def load_code_table(self, table_name, file_path):
+        """Loads a code table file into the specified table."""
+        print(f'Loading code table from {file_path} into {table_name}')
+        df = pl.read_csv(file_path, separator=';', has_header=False, new_columns=['codigo', 'descricao'], encoding='latin1', infer_schema_length=0)
+        if self.backend == 'duckdb':
+            # DuckDB reads the Polars DataFrame directly
+            self.engine.register('code_table_df', df)
+            self.engine.execute(f'INSERT INTO "{table_name}" SELECT * FROM code_table_df;')
+            self.engine.unregister('code_table_df')
+        else:
+            self._insert_rows(table_name, df.iter_rows())
+        if self.delete_unzipped_files:
+            print(f'Deleting file {file_path}')
+            os.remove(file_path)
+    
+    def _insert_rows(self, table_name, rows):
+        """Inserts code table rows into SQLite in batches inside a single transaction."""
+        self.engine.execute('BEGIN')
+        while batch := list(itertools.islice(rows, self.insert_batch_size)):
+            self.engine.executemany(f'INSERT INTO "{table_name}" VALUES (?, ?);', batch)
+        self.engine.execute('COMMIT')
+    
+    def create_database_tables(self):
+        """Defines the schemas and creates the code and main tables in the database, without indexes."""
+        # Code tables, keyed by the extension of their source file
+        self.code_tables = {
             '.CNAECSV': 'cnae',
             '.MOTICSV': 'motivo',
             '.MUNICCSV': 'municipio',
@@ -74,22 +230,6 @@ class CNPJDatabaseBuilder:
             '.PAISCSV': 'pais',
             '.QUALSCSV': 'qualificacao_socio'
         }
-        for extension, table_name in code_files.items():
-            file_path = glob.glob(os.path.join(self.output_folder, f'*{extension}'))
-            if file_path:
-                file_path = file_path[0]
-                print(f'Loading code table from {file_path} into {table_name}')
-                df = pd.read_csv(file_path, sep=';', encoding='latin1', header=None, names=['codigo','descricao'], dtype=str)
-                df.to_sql(table_name, self.engine, if_exists='replace', index=False)
-                self.engine.execute(f'CREATE INDEX idx_{table_name} ON {table_name}(codigo);')
-                if self.delete_unzipped_files:
-                    print(f'Deleting file {file_path}')
-                    os.remove(file_path)
-            else:
-                print(f'File with extension {extension} not found.')
-    
-    def create_database_tables(self):
-        """Defines the schemas and creates the main tables in the database."""
         # Define the schema for the main tables
         self.colunas_empresas = ['cnpj_basico', 'razao_social',
                'natureza_juridica',
@@ -138,60 +278,112 @@ class CNPJDatabaseBuilder:
             'opcao_mei',
             'data_opcao_mei',
             'data_exclusao_mei']
+        # Column types of the tables
+        self.tipos_empresas = self._columns_types(col for col in self.colunas_empresas if col != 'capital_social_str')
+        # REAL is a 4-byte FLOAT in DuckDB, too coarse for company capitals
+        self.tipos_empresas['capital_social'] = 'DOUBLE' if self.backend == 'duckdb' else 'REAL'
+        self.tipos_estabelecimento = self._columns_types(self.colunas_estabelecimento)
+        self.tipos_estabelecimento['cnpj'] = 'TEXT'
+        self.tipos_socios = self._columns_types(self.colunas_socios)
+        self.tipos_simples = self._columns_types(self.colunas_simples)
+        # Derived columns are computed from the CSV columns while loading,
+        # so the loaded tables never need to be rewritten with UPDATE
+        self.select_empresas = self._select_columns(self.tipos_empresas)
+        # Empty or unparsable values become 0, as SQLite's CAST(... AS REAL) did
+        self.select_empresas['capital_social'] = "COALESCE(TRY_CAST(REPLACE(capital_social_str, ',', '.') AS DOUBLE), 0)"
+        self.select_estabelecimento = self._select_columns(self.tipos_estabelecimento)
+        # Built from the CSV text, so the leading zeros of cnpj_basico are kept
+        self.select_estabelecimento['cnpj'] = 'cnpj_basico || cnpj_ordem || cnpj_dv'
+        # Large tables, keyed by the extension of their source files
+        self.large_tables = {
+            '.EMPRECSV': ('empresas', self.colunas_empresas, self.select_empresas),
+            '.ESTABELE': ('estabelecimento', self.colunas_estabelecimento, self.select_estabelecimento),
+            '.SOCIOCSV': ('socios_original', self.colunas_socios, self._select_columns(self.tipos_socios)),
+            '.SIMPLES.CSV.*': ('simples', self.colunas_simples, self._select_columns(self.tipos_simples))
+        }
         # Create the tables in the database
-        self.create_table('empresas', self.colunas_empresas)
-        self.create_table('estabelecimento', self.colunas_estabelecimento)
-        self.create_table('socios_original', self.colunas_socios)
-        self.create_table('simples', self.colunas_simples)
-    
-    def create_table(self, table_name, columns):
-        """Creates a table in the database with the specified columns."""
-        columns_sql = ',\n'.join([f'"{col}" TEXT' for col in columns])
+        for table_name in self.code_tables.values():
+            self.create_table(table_name, {'codigo': 'TEXT', 'descricao': 'TEXT'})
+        self.create_table('empresas', self.tipos_empresas)
+        self.create_table('estabelecimento', self.tipos_estabelecimento)
+        self.create_table('socios_original', self.tipos_socios)
+        self.create_table('simples', self.tipos_simples)
+    
+    @staticmethod
+    def _columns_types(columns):
+        """Maps each column to its SQLite type: cnpj_basico and the YYYYMMDD dates are INTEGER, the rest TEXT."""
+        return {col: 'INTEGER' if col == 'cnpj_basico' or col.startswith('data_') else 'TEXT' for col in columns}
+    
+    @staticmethod
+    def _select_columns(columns_types):
+        """Maps each column to the DuckDB expression that reads it from the CSV columns with its type."""
+        return {col: f'TRY_CAST({col} AS BIGINT)' if col_type == 'INTEGER' else col for col, col_type in columns_types.items()}
+    
+    def create_table(self, table_name, columns_types):
+        """Creates a table in the database with the specified columns and their types."""
+        columns_sql = ',\n'.join([f'"{col}" {col_type}' for col, col_type in columns_types.items()])
         sql = f'CREATE TABLE "{table_name}" (\n{columns_sql}\n);'
         self.engine.execute(sql)
     
-    def load_large_tables(self):
-        """Loads the larger tables into the database using Dask for efficiency."""
-        self.load_large_table('empresas', '.EMPRECSV', self.colunas_empresas)
-        self.load_large_table('estabelecimento', '.ESTABELE', self.colunas_estabelecimento)
-        self.load_large_table('socios_original', '.SOCIOCSV', self.colunas_socios)
-        self.load_large_table('simples', '.SIMPLES.CSV.*', self.colunas_simples)
-    
-    def load_large_table(self, table_name, file_extension, columns):
-        """Loads data from CSV files into the specified table."""
-        file_paths = glob.glob(os.path.join(self.output_folder, f'*{file_extension}'))
-        for file_path in file_paths:
-            print(f'Loading data from {file_path} into table {table_name}')
-            ddf = dd.read_csv(file_path, sep=';', header=None, names=columns, encoding='latin1', dtype=str, na_filter=False)
-            ddf.to_sql(table_name, self.engine_url, if_exists='append', index=False, dtype=sqlalchemy.types.Text)
-            if self.delete_unzipped_files:
-                print(f'Deleting file {file_path}')
-                os.remove(file_path)
+    def _csv_to_parquet(self, file_path, columns):
+        """Converts a CSV file to a ZSTD-compressed Parquet file, reusing a previous conversion if present."""
+        parquet_path = _parquet_path(self.output_folder, file_path)
+        os.makedirs(os.path.dirname(parquet_path), exist_ok=True)
+        if os.path.exists(parquet_path):
+            print(f'Using cached Parquet file {parquet_path}')
+            return parquet_path
+        print(f'Converting {file_path} to {parquet_path}')
+        reader = pa_csv.open_csv(
+            file_path,
+            read_options=pa_csv.ReadOptions(column_names=columns, encoding='latin1'),
+            parse_options=pa_csv.ParseOptions(delimiter=';'),
+            convert_options=pa_csv.ConvertOptions(column_types={col: pa.string() for col in columns})
+        )
+        # Write to a temporary name so an interrupted conversion is never mistaken for a cached one
+        tmp_path = parquet_path + '.tmp'
+        with pq.ParquetWriter(tmp_path, reader.schema, compression='zstd') as writer:
+            for batch in reader:
+                writer.write_batch(batch)
+        os.replace(tmp_path, parquet_path)
+        return parquet_path
+    
+    def load_large_file(self, table_name, columns, select_columns, file_path):
+        """Loads a single CSV file into the specified table through a Parquet cache."""
+        # select_columns maps each table column to the SQL expression computed from the CSV columns
+        insert_columns = ', '.join(select_columns)
+        select_sql = ', '.join(select_columns.values())
+        parquet_path = self._csv_to_parquet(file_path, columns)
+        # On a cache hit the CSV was never extracted
+        if self.delete_unzipped_files and os.path.exists(file_path):
+            print(f'Deleting file {file_path}')
+            os.remove(file_path)
+        print(f'Loading data from {parquet_path} into table {table_name}')
+        self.duck.execute(
+            f'INSERT INTO {self.table_prefix}{table_name} ({insert_columns}) SELECT {select_sql} FROM read_parquet(?);',
+            [parquet_path]
+        )
     
     def adjust_tables_and_create_indexes(self):
-        """Performs adjustments on tables and creates necessary indexes."""
+        """Performs adjustments on tables and creates all indexes once the data is loaded."""
+        code_table_indexes = [f'CREATE INDEX idx_{table_name} ON {table_name}(codigo);' for table_name in self.code_tables.values()]
         sql_commands = [
-            # Adjust capital_social
-            'ALTER TABLE empresas ADD COLUMN capital_social REAL;',
-            "UPDATE empresas SET capital_social = CAST(REPLACE(capital_social_str, ',', '.') AS REAL);",
-            'ALTER TABLE empresas DROP COLUMN capital_social_str;',
-            # Create cnpj field in estabelecimento
-            'ALTER TABLE estabelecimento ADD COLUMN cnpj TEXT;',
-            "UPDATE estabelecimento SET cnpj = cnpj_basico || cnpj_ordem || cnpj_dv;",
             # Create indexes
+            *code_table_indexes,
             'CREATE INDEX idx_empresas_cnpj_basico ON empresas(cnpj_basico);',
             'CREATE INDEX idx_empresas_razao_social ON empresas(razao_social);',
-            'CREATE INDEX idx_estabelecimento_cnpj_basico ON estabelecimento(cnpj_basico);',
+            # Covers the socios join below, so it is resolved from the index alone
+            'CREATE INDEX idx_estabelecimento_cnpj_basico ON estabelecimento(cnpj_basico, matriz_filial, cnpj);',
             'CREATE INDEX idx_estabelecimento_cnpj ON estabelecimento(cnpj);',
             'CREATE INDEX idx_estabelecimento_nomefantasia ON estabelecimento(nome_fantasia);',
             'CREATE INDEX idx_socios_original_cnpj_basico ON socios_original(cnpj_basico);',
+            # Refresh the join's planner statistics without scanning every other index
+            'ANALYZE estabelecimento;',
             # Create socios table
             '''
             CREATE TABLE socios AS 
             SELECT te.cnpj AS cnpj, ts.*
             FROM socios_original ts
-            LEFT JOIN estabelecimento te ON te.cnpj_basico = ts.cnpj_basico
-            WHERE te.matriz_filial = '1';
+            INNER JOIN estabelecimento te ON te.cnpj_basico = ts.cnpj_basico AND te.matriz_filial = '1';
             ''',
             'DROP TABLE IF EXISTS socios_original;',
             # Indexes on socios
@@ -210,17 +402,36 @@ class CNPJDatabaseBuilder:
             );
             '''
         ]
+        if self.backend == 'duckdb':
+            # DuckDB prunes scans with its zone maps, so no indexes are created
+            sql_commands = [sql for sql in sql_commands if not sql.startswith('CREATE INDEX')]
         print('Adjusting tables and creating indexes:', time.asctime())
+        if self.backend == 'sqlite':
+            # foreign_keys can only be changed outside a transaction
+            self.engine.execute('PRAGMA foreign_keys=OFF;')
+            self.engine.execute('PRAGMA defer_foreign_keys=ON;')
+        # Run every command with execute(), since executescript() would commit the open transaction
+        self.engine.execute('BEGIN')
         for sql in sql_commands:
             print(f'Executing SQL command: {sql}')
-            self.engine.executescript(sql)
+            self.engine.execute(sql)
+        self.engine.execute('COMMIT')
         print('Finished adjusting tables and creating indexes:', time.asctime())
     
     def insert_reference_data(self):
         """Inserts reference data into the database."""
-        qtde_cnpjs = self.engine.execute('SELECT COUNT(*) FROM estabelecimento;').fetchone()[0]
-        self.engine.execute('INSERT INTO _referencia (referencia, valor) VALUES (?, ?);', ('CNPJ', self.data_reference))
-        self.engine.execute('INSERT INTO _referencia (referencia, valor) VALUES (?, ?);', ('cnpj_qtde', str(qtde_cnpjs)))
+        data_reference = self.data_reference.replace("'", "''")
+        script = f'''
+            BEGIN;
+            INSERT INTO _referencia (referencia, valor) VALUES ('CNPJ', '{data_reference}');
+            INSERT INTO _referencia (referencia, valor) SELECT 'cnpj_qtde', CAST(COUNT(*) AS TEXT) FROM estabelecimento;
+            COMMIT;
+        '''
+        # DuckDB's execute() runs every statement of a script
+        if self.backend == 'duckdb':
+            self.engine.execute(script)
+        else:
+            self.engine.executescript(script)
     
     def cleanup(self):
         """Cleans up resources and closes the database connection."""
@@ -231,12 +442,11 @@ class CNPJDatabaseBuilder:
     def build_database(self):
         """Orchestrates the steps to build the database."""
         self.check_and_prepare_output()
-        self.unzip_files()
+        self.check_zip_files()
         self.connect_to_database()
-        self.get_data_reference()
-        self.load_code_tables()
         self.create_database_tables()
-        self.load_large_tables()
+        self.unzip_and_load_files()
+        self.get_data_reference()
         self.adjust_tables_and_create_indexes()
         self.insert_reference_data()
         self.cleanup()
\ No newline at end of file
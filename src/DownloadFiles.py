@@ -1,5 +1,7 @@
 import os
+import shutil
 import requests
+import urllib3
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin
 from tqdm import tqdm
@@ -8,16 +10,56 @@ import threading
 import signal
 import sys
 
+class _ProgressReader:
+    """
+    File-like wrapper around a raw HTTP response that updates a progress bar on each read
+    and reports end of file once the stop event is set.
+    """
+    def __init__(self, raw, progress_bar, stop_event):
+        self.raw = raw
+        self.progress_bar = progress_bar
+        self.stop_event = stop_event
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        if self.stop_event.is_set():
+            return b''
+        data = self.raw.read(size)
+        self.bytes_read += len(data)
+        self.progress_bar.update(len(data))
+        return data
+
+
+class _OffsetWriter:
+    """
+    File-like wrapper that writes sequentially into a file descriptor starting at a fixed offset.
+    """
+    def __init__(self, fd, offset):
+        self.fd = fd
+        self.offset = offset
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(self.fd, view, self.offset)
+            self.offset += written
+            view = view[written:]
+        return len(data)
+
+
 class DownloadFiles:
-    def __init__(self, output_dir='output', max_workers=5):
+    def __init__(self, output_dir='output', max_workers=5, range_parts=4):
         """
         Initialize the DownloadFiles class with an output directory and thread pool size.
 
         :param output_dir: Directory where ZIP files will be downloaded.
         :param max_workers: Maximum number of parallel download threads.
+        :param range_parts: Number of parallel HTTP Range requests used for each file.
         """
         self.output_dir = output_dir
         self.max_workers = max_workers
+        self.range_parts = range_parts
+        self.chunk_size = 1024 * 1024
         self.stop_event = threading.Event()  # Event to signal threads to stop
         self._create_output_dir()
 
@@ -33,6 +75,9 @@ class DownloadFiles:
                 print(f"Error creating directory {self.output_dir}: {e}")
                 raise
 
+    # Byte multipliers for the size suffixes used in the directory listing
+    _SIZE_MULTIPLIERS = {'G': 1024**3, 'M': 1024**2, 'K': 1024}
+
     def _parse_size(self, size_str):
         """
         Convert human-readable file size to bytes.
@@ -41,60 +86,142 @@ class DownloadFiles:
         :return: Size in bytes as an integer.
         """
         size_str = size_str.strip().upper()
-        if size_str.endswith('G'):
-            return int(float(size_str[:-1]) * 1024**3)
-        elif size_str.endswith('M'):
-            return int(float(size_str[:-1]) * 1024**2)
-        elif size_str.endswith('K'):
-            return int(float(size_str[:-1]) * 1024)
-        elif size_str == '-' or size_str == '':
+        if size_str == '-' or size_str == '':
+            return 0
+        multiplier = self._SIZE_MULTIPLIERS.get(size_str[-1])
+        try:
+            if multiplier:
+                return int(float(size_str[:-1]) * multiplier)
+            return int(size_str)
+        except ValueError:
+            print(f"Unknown size format: '{size_str}'. Assuming size is 0.")
             return 0
-        else:
-            try:
-                return int(size_str)
-            except ValueError:
-                print(f"Unknown size format: '{size_str}'. Assuming size is 0.")
-                return 0
 
-    def _download_single_file(self, zip_url, filename, zip_href, remote_size, position):
+    def _download_range(self, zip_url, fd, start, end, progress_bar):
         """
-        Download a single ZIP file with a progress bar.
+        Download one byte range of a file and write it at the same offset of the local file.
+
+        :param zip_url: URL of the ZIP file to download.
+        :param fd: File descriptor of the pre-allocated local file.
+        :param start: First byte of the range.
+        :param end: Last byte of the range (inclusive).
+        :param progress_bar: tqdm progress bar shared by all downloads.
+        :return: Number of bytes downloaded, or None if the server did not serve exactly the requested range.
+        """
+        # Byte ranges address the encoded body, so ask for it unencoded and copy it as is
+        headers = {'Range': f'bytes={start}-{end}', 'Accept-Encoding': 'identity'}
+        with requests.get(zip_url, headers=headers, stream=True) as r:
+            if (r.status_code != 206
+                    or r.headers.get('content-encoding', 'identity').lower() != 'identity'
+                    or not r.headers.get('content-range', '').startswith(f'bytes {start}-{end}/')):
+                # 416, a full 200 response, an encoded body or another range: the server does not serve this range as is
+                return None
+            reader = _ProgressReader(r.raw, progress_bar, self.stop_event)
+            shutil.copyfileobj(reader, _OffsetWriter(fd, start), self.chunk_size)
+        if not self.stop_event.is_set() and reader.bytes_read != end - start + 1:
+            # A short body would leave a hole of zeros in the pre-allocated file
+            progress_bar.update(-reader.bytes_read)
+            return None
+        return reader.bytes_read
+
+    def _download_ranges(self, zip_url, filename, total_size, progress_bar):
+        """
+        Download a file with parallel HTTP Range requests into a pre-allocated local file.
 
         :param zip_url: URL of the ZIP file to download.
         :param filename: Local path where the ZIP file will be saved.
-        :param zip_href: Name of the ZIP file (used for the progress bar description).
-        :param remote_size: Expected size of the ZIP file in bytes.
-        :param position: Position index for the tqdm progress bar.
+        :param total_size: Size of the remote file in bytes.
+        :param progress_bar: tqdm progress bar shared by all downloads.
+        :return: True if every range was served, False if the caller should fall back to a single stream.
         """
+        part_size = -(-total_size // self.range_parts)
+        ranges = [(start, min(start + part_size, total_size) - 1) for start in range(0, total_size, part_size)]
+        fd = os.open(filename, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
         try:
-            with requests.get(zip_url, stream=True) as r:
-                r.raise_for_status()
-                total_size = int(r.headers.get('content-length', 0))
-                block_size = 8192
-                progress_bar = tqdm(
-                    total=total_size,
-                    unit='iB',
-                    unit_scale=True,
-                    desc=zip_href,
-                    position=position,
-                    leave=False
-                )
-                with open(filename, 'wb') as f:
-                    for chunk in r.iter_content(chunk_size=block_size):
-                        if self.stop_event.is_set():
-                            # Stop event is set; terminate the download
-                            print(f"\nStopping download for {filename}")
-                            progress_bar.close()
-                            return
-                        if chunk:
-                            f.write(chunk)
-                            progress_bar.update(len(chunk))
-                progress_bar.close()
-                print(f"Successfully downloaded: {filename}")
-        except requests.exceptions.RequestException as e:
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(fd, 0, total_size)
+            else:
+                os.ftruncate(fd, total_size)
+            with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                futures = [executor.submit(self._download_range, zip_url, fd, start, end, progress_bar) for start, end in ranges]
+                results = [future.result() for future in futures]
+            if None in results:
+                # Take back the bytes of the served ranges, the file is downloaded again
+                progress_bar.update(-sum(result for result in results if result))
+                return False
+            return True
+        finally:
+            os.close(fd)
+
+    def _download_stream(self, zip_url, filename, total_size, progress_bar):
+        """
+        Download a file over a single HTTP stream.
+
+        :param zip_url: URL of the ZIP file to download.
+        :param filename: Local path where the ZIP file will be saved.
+        :param total_size: Expected size of the file in bytes, used to pre-allocate it (0 if unknown).
+        :param progress_bar: tqdm progress bar shared by all downloads.
+        """
+        with requests.get(zip_url, stream=True) as r:
+            r.raise_for_status()
+            r.raw.decode_content = True
+            with open(filename, 'wb') as f:
+                if total_size > 0 and hasattr(os, 'posix_fallocate'):
+                    os.posix_fallocate(f.fileno(), 0, total_size)
+                shutil.copyfileobj(_ProgressReader(r.raw, progress_bar, self.stop_event), f, self.chunk_size)
+                # Drop any pre-allocated space that was not written
+                f.truncate()
+
+    def _remove_partial_file(self, filename):
+        """
+        Remove a partially downloaded file. Pre-allocated files have their full size
+        from the start, so a partial one could otherwise pass the size check on the next run.
+
+        :param filename: Local path of the ZIP file.
+        """
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
+
+    def _download_single_file(self, zip_url, filename, progress_bar):
+        """
+        Download a single ZIP file, splitting it into parallel HTTP Range requests
+        when the server supports them.
+
+        :param zip_url: URL of the ZIP file to download.
+        :param filename: Local path where the ZIP file will be saved.
+        :param progress_bar: tqdm progress bar shared by all downloads.
+        """
+        try:
+            try:
+                head = requests.head(zip_url, allow_redirects=True, headers={'Accept-Encoding': 'identity'})
+                head.raise_for_status()
+                total_size = int(head.headers.get('content-length', 0))
+                accepts_ranges = head.headers.get('accept-ranges', '').lower() == 'bytes'
+            except requests.exceptions.RequestException:
+                # Some servers and proxies reject HEAD; download over a single stream instead
+                total_size, accepts_ranges = 0, False
+            use_ranges = accepts_ranges and total_size > 0 and self.range_parts > 1 and hasattr(os, 'pwrite')
+            if not use_ranges or not self._download_ranges(zip_url, filename, total_size, progress_bar):
+                self._download_stream(zip_url, filename, total_size, progress_bar)
+            if self.stop_event.is_set():
+                # Stop event is set; the download was terminated
+                print(f"\nStopping download for {filename}")
+                self._remove_partial_file(filename)
+                return
+            print(f"Successfully downloaded: {filename}")
+        except (requests.exceptions.RequestException, urllib3.exceptions.HTTPError) as e:
+            # Bodies are read from r.raw, so errors raised while streaming come from urllib3 directly
             print(f"Error downloading {zip_url}: {e}")
+            self._remove_partial_file(filename)
         except OSError as e:
             print(f"Error saving {filename}: {e}")
+            self._remove_partial_file(filename)
+        except Exception:
+            # Never leave a partial file behind, whatever interrupted the download
+            self._remove_partial_file(filename)
+            raise
 
     def download_zip_files(self, url):
         """
@@ -132,7 +259,7 @@ class DownloadFiles:
 
         # Prepare a list of download tasks
         download_tasks = []
-        for idx, link in enumerate(zip_links):
+        for link in zip_links:
             zip_href = link.get('href')
             zip_url = urljoin(url, zip_href)
             filename = os.path.join(self.output_dir, zip_href)
@@ -152,16 +279,21 @@ class DownloadFiles:
                 else:
                     print(f"File exists but size differs (local: {local_size} bytes, remote: {remote_size} bytes). Re-downloading.")
 
-            # Assign a unique position for each progress bar
-            position = idx % self.max_workers
-
             # Append the download task details
-            download_tasks.append((zip_url, filename, zip_href, remote_size, position))
+            download_tasks.append((zip_url, filename, zip_href, remote_size))
 
         if not download_tasks:
             print("No files need to be downloaded.")
             return
 
+        # A single progress bar tracks the bytes of all downloads
+        progress_bar = tqdm(
+            total=sum(task[3] for task in download_tasks),
+            unit='B',
+            unit_scale=True,
+            desc='Downloading'
+        )
+
         # Initialize the ThreadPoolExecutor
         with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
             # Submit all download tasks
@@ -170,9 +302,7 @@ class DownloadFiles:
                     self._download_single_file,
                     task[0],  # zip_url
                     task[1],  # filename
-                    task[2],  # zip_href
-                    task[3],  # remote_size
-                    task[4]   # position
+                    progress_bar
                 ): task for task in download_tasks
             }
 
@@ -190,4 +320,5 @@ class DownloadFiles:
                 executor.shutdown(wait=False)
                 print("All download tasks have been signaled to stop.")
 
+        progress_bar.close()
         print("All download tasks have been processed.")
\ No newline at end of file
@@ -4,6 +4,9 @@ from urllib.parse import urljoin
 import re
 from datetime import datetime
 
+# Regular expression to match hrefs like 'yyyy-mm/'
+_MONTH_RE = re.compile(r'^(\d{4})-(\d{2})/$')
+
 class ExtractUrl:
     def __init__(self, base_url):
         """
@@ -12,14 +15,19 @@ class ExtractUrl:
         :param base_url: The main URL to scrape.
         """
         self.base_url = base_url
+        self._latest_url = None
 
     def get_latest_month_url(self):
         """
         Fetch the main page, parse the HTML, and find the latest month's URL.
+        The result is cached, so the main page is only fetched once.
 
         :return: Full URL to the latest month's directory.
         :raises ValueError: If no valid month links are found.
         """
+        if self._latest_url is not None:
+            return self._latest_url
+
         try:
             response = requests.get(self.base_url)
             response.raise_for_status()  # Raise an exception for HTTP errors
@@ -29,9 +37,7 @@ class ExtractUrl:
 
         soup = BeautifulSoup(response.text, 'html.parser')
 
-        # Regular expression to match hrefs like 'yyyy-mm/'
-        month_pattern = re.compile(r'^\d{4}-\d{2}/$')
-        month_links = soup.find_all('a', href=month_pattern)
+        month_links = soup.find_all('a', href=_MONTH_RE)
 
         if not month_links:
             raise ValueError("No month links found on the page.")
@@ -40,7 +46,7 @@ class ExtractUrl:
         months = []
         for link in month_links:
             href = link.get('href')
-            match = re.match(r'^(\d{4})-(\d{2})/$', href)
+            match = _MONTH_RE.match(href)
             if match:
                 year, month = int(match.group(1)), int(match.group(2))
                 months.append((year, month, href))
@@ -53,8 +59,8 @@ class ExtractUrl:
         latest_year, latest_month, latest_href = latest
 
         # Construct the full URL for the latest month
-        latest_month_url = urljoin(self.base_url, latest_href)
-        return latest_month_url
+        self._latest_url = urljoin(self.base_url, latest_href)
+        return self._latest_url
 
     def fetch_latest_month_page(self):
         """